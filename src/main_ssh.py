@@ -1,9 +1,19 @@
 # Here’s where you define your tools (functions the AI can use)
 from mcp.server.fastmcp import Context, FastMCP
 from mcp.types import TextContent
+import asyncssh
 import paramiko
 import logging
 import asyncio
+import contextlib
+import functools
+import hashlib
+import hmac
+import json
+import os
+import time
+from collections import deque
+import secrets
 from pathlib import Path
 import uuid
 from typing import Literal, Optional, Dict, Any, List, Union
@@ -18,74 +28,354 @@ logger = logging.getLogger(__name__)
 # 创建MCP服务器实例
 mcp = FastMCP("SSHServer", host="0.0.0.0", port=8000)
 
+# 空闲连接超时时间与回收检查间隔（秒）
+_IDLE_TIMEOUT = 600
+_REAP_INTERVAL = 60
+# 流式执行时在返回结果中保留的末尾行数
+_STREAM_TAIL_LINES = 200
+# 批量执行时同时进行的命令数上限，避免耗尽文件描述符
+_MAX_PARALLEL_EXEC = 32
+# 会话清单文件：记录各会话的连接参数（不含套接字和密码），服务重启后可按需重连
+_MANIFEST_PATH = Path("~/.cache/autotenpy/sessions.json").expanduser()
+# 会话清单记录的有效期（秒）：超过该时间未使用的会话不再自动恢复
+_MANIFEST_TTL = 24 * 3600
+
+
+@functools.lru_cache(maxsize=1)
+def _parsed_ssh_config() -> paramiko.SSHConfig:
+    """读取并解析 ~/.ssh/config，结果在进程内缓存"""
+    ssh_config = paramiko.SSHConfig()
+    config_path = Path.home() / ".ssh/config"
+
+    if config_path.exists():
+        with open(config_path) as f:
+            ssh_config.parse(f)
+        return ssh_config
+    else:
+        raise FileNotFoundError("SSH config file not found")
+
 
 # SSH连接管理器
 class SSHConnectionManager:
     
     def __init__(self):
         self.connections = {}
+        # (hostname, port, username, key_path, 密码摘要) -> session_id，
+        # 端点和凭据都相同时才复用已有连接，避免凭据错误的请求拿到他人已登录的会话
+        self._by_endpoint: Dict[tuple, str] = {}
+        self._endpoints: Dict[str, tuple] = {}
+        # 进程内随机密钥，仅用于计算密码摘要，不保存明文密码
+        self._digest_key = secrets.token_bytes(32)
+        self._last_used: Dict[str, float] = {}
+        # 各会话正在执行的命令数，大于零时不视为空闲
+        self._in_flight: Dict[str, int] = {}
+        self._reaper: Optional[asyncio.Task] = None
+        # 同一端点的并发连接请求串行化，避免重复握手
+        self._endpoint_locks: Dict[tuple[str, int, str], asyncio.Lock] = {}
+        # 持有后台任务的引用，防止其被垃圾回收
+        self._tasks: set[asyncio.Task] = set()
+        # 同一会话的并发恢复请求串行化，避免重复连接导致旧连接泄漏
+        self._session_locks: Dict[str, asyncio.Lock] = {}
+        self._manifest_path = _MANIFEST_PATH
+        self._manifest: Dict[str, Dict[str, Any]] = self._read_manifest()
+        self._manifest_lock = asyncio.Lock()
     
+    @staticmethod
     def load_ssh_config(host_alias: str) -> dict:
         """解析 ~/.ssh/config 获取指定主机的配置"""
-        ssh_config = paramiko.SSHConfig()
-        config_path = Path.home() / ".ssh/config"
-        
-        if config_path.exists():
-            with open(config_path) as f:
-                ssh_config.parse(f)
-            return ssh_config.lookup(host_alias)  # 返回字典格式的配置
-        else:
-            raise FileNotFoundError("SSH config file not found")
+        return _parsed_ssh_config().lookup(host_alias)  # 返回字典格式的配置
     
     async def create_connection(self, hostname: str, port: int,
                                username: str, password: str = None, key_path: str = None):
         """创建持久SSH连接并存储到会话状态"""
 
-        session_id = str(uuid.uuid4())  # 生成唯一会话ID
+        endpoint = (hostname, port, username)
+        pool_key = self._pool_key(hostname, port, username, password, key_path)
+        async with self._endpoint_locks.setdefault(endpoint, asyncio.Lock()):
+            session_id = self._by_endpoint.get(pool_key)
+            if session_id in self.connections:
+                self._last_used[session_id] = time.monotonic()
+                return f"复用已有SSH连接: {username}@{hostname}:{port}", session_id
 
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
-        try:
-            if key_path:
-                private_key = paramiko.RSAKey.from_private_key_file(key_path)
-                ssh.connect(hostname, port, username, pkey=private_key)
-            else:
-                ssh.connect(hostname, port, username, password)
-                
-            self.connections[session_id] = ssh
+            # 服务重启或空闲断开后，沿用会话清单中同一端点的会话ID，而不是再登记一个新ID
+            if password is None:
+                session_id = self._manifest_session_for(endpoint, key_path)
+                if session_id is not None and await self.ensure_connection(session_id):
+                    return f"SSH连接成功: {username}@{hostname}:{port}", session_id
+
+            session_id = str(uuid.uuid4())  # 生成唯一会话ID
+
+            try:
+                await self._connect(session_id, hostname, port, username, password, key_path)
+            except Exception as e:
+                return f"连接失败: {str(e)}", None
+
+            # 密码不落盘，因此密码登录的会话无法在重启后自动恢复
+            if password is None:
+                # 同一端点只保留一条记录
+                stale = [sid for sid, entry in self._manifest.items()
+                         if (entry["hostname"], entry["port"], entry["username"]) == endpoint]
+                await self._update_manifest(
+                    upsert={session_id: {
+                        "hostname": hostname, "port": port,
+                        "username": username, "key_path": key_path,
+                    }},
+                    remove=stale,
+                )
             return f"SSH连接成功: {username}@{hostname}:{port}", session_id
-        except Exception as e:
-            return f"连接失败: {str(e)}"
+
+    async def ensure_connection(self, session_id: str) -> bool:
+        """确保会话有活动连接；若仅存在于会话清单中（如服务重启后），按记录的参数重新连接"""
+        if session_id in self.connections:
+            return True
+        if session_id not in self._manifest:
+            return False
+        async with self._session_locks.setdefault(session_id, asyncio.Lock()):
+            # 等锁期间可能已被其他请求恢复或关闭
+            if session_id in self.connections:
+                return True
+            entry = self._manifest.get(session_id)
+            if entry is None:
+                return False
+            if time.time() - entry.get("last_used", 0) > _MANIFEST_TTL:
+                await self._update_manifest(remove=[session_id])
+                return False
+            try:
+                await self._connect(session_id, entry["hostname"], entry["port"],
+                                    entry["username"], key_path=entry["key_path"])
+            except Exception as e:
+                logger.warning("Failed to restore SSH session %s: %s", session_id, e)
+                return False
+            # 重连期间会话可能已被关闭（清单记录被删除），此时不应保留新连接
+            if session_id not in self._manifest:
+                await self._drop_connection(session_id)
+                return False
+            await self._update_manifest(touch=[session_id])
+            logger.info("Restored SSH session %s", session_id)
+            return True
+
+    def _pool_key(self, hostname: str, port: int, username: str,
+                  password: Optional[str], key_path: Optional[str]) -> tuple:
+        """连接池键：端点加凭据（密码以 HMAC 摘要参与比较）"""
+        digest = None
+        if password is not None:
+            digest = hmac.new(self._digest_key, password.encode("utf-8"), hashlib.sha256).hexdigest()
+        return (hostname, port, username, key_path, digest)
+
+    def _manifest_session_for(self, endpoint: tuple[str, int, str], key_path: Optional[str]) -> Optional[str]:
+        """在会话清单中查找连接参数相同的会话ID"""
+        for session_id, entry in self._manifest.items():
+            if ((entry["hostname"], entry["port"], entry["username"]) == endpoint
+                    and entry["key_path"] == key_path):
+                return session_id
+        return None
+
+    async def _connect(self, session_id: str, hostname: str, port: int,
+                       username: str, password: str = None, key_path: str = None):
+        """建立连接并以给定 session_id 登记"""
+        # known_hosts=None 对应原先的 AutoAddPolicy，不校验主机密钥。
+        # 未指定密钥时不传 client_keys：显式传 None 会关闭公钥认证，
+        # 省略时才会像 paramiko 默认那样尝试 ~/.ssh/id_* 和 ssh-agent
+        kwargs = {"client_keys": [key_path]} if key_path else {}
+        ssh = await asyncssh.connect(
+            hostname, port=port, username=username,
+            password=password, known_hosts=None, **kwargs
+        )
+
+        pool_key = self._pool_key(hostname, port, username, password, key_path)
+        # 若该端点已有其他活动会话，保留原映射，新连接仅按 session_id 访问
+        if self._by_endpoint.get(pool_key) not in self.connections:
+            self._by_endpoint[pool_key] = session_id
+        self.connections[session_id] = ssh
+        self._endpoints[session_id] = pool_key
+        self._last_used[session_id] = time.monotonic()
+        # 连接意外断开时清理记录，避免复用失效连接
+        self._spawn(self._forget_on_close(session_id, ssh))
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_idle_connections())
     
 
     async def exec_command(self, command: str, session_id: str) -> str:
         """通过持久连接执行命令"""
         
-        print(self.connections.keys())
-        print("session_id:", session_id)
-        if session_id not in self.connections:
+        logger.debug("session keys: %s", list(self.connections))
+        logger.debug("session_id=%s", session_id)
+        if not await self.ensure_connection(session_id):
             return "无活动SSH连接，请先建立连接"
         
         ssh = self.connections[session_id]
+        self._begin_use(session_id)
         try:
-            stdin, stdout, stderr = ssh.exec_command(command)
-            output = stdout.read().decode('utf-8')
-            error = stderr.read().decode('utf-8')
-            return f"$ {command}\n{output}{error}" if output or error else "命令已执行"
+            # encoding=None 时返回原始字节，最后一次性解码，非 UTF-8 输出不会导致失败
+            result = await ssh.run(command, check=False, encoding=None)
+            if not (result.stdout or result.stderr):
+                return "命令已执行"
+            buf = bytearray(f"$ {command}\n".encode('utf-8'))
+            buf += result.stdout or b""
+            buf += result.stderr or b""
+            return buf.decode('utf-8', 'replace')
         except Exception as e:
             return f"执行失败: {str(e)}"
+        finally:
+            self._end_use(session_id)
+    
+
+    async def stream_command(self, command: str, session_id: str):
+        """通过持久连接执行命令，逐行产出合并后的 stdout/stderr"""
+        if not await self.ensure_connection(session_id):
+            raise ConnectionError("无活动SSH连接，请先建立连接")
+        ssh = self.connections[session_id]
+        self._begin_use(session_id)
+        try:
+            # errors='replace'：非 UTF-8 输出不会中断流式读取
+            async with ssh.create_process(command, stderr=asyncssh.STDOUT,
+                                          errors='replace') as proc:
+                async for line in proc.stdout:
+                    self._last_used[session_id] = time.monotonic()
+                    yield line
+                await proc.wait()
+        finally:
+            self._end_use(session_id)
+
+    def _spawn(self, coro):
+        """创建后台任务并保留引用，任务结束后自动移除"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _begin_use(self, session_id: str):
+        """登记一条正在执行的命令，期间回收任务不会关闭该连接"""
+        self._in_flight[session_id] = self._in_flight.get(session_id, 0) + 1
+        self._last_used[session_id] = time.monotonic()
+
+    def _end_use(self, session_id: str):
+        """命令结束：减少计数，并从此刻重新计算空闲时间"""
+        count = self._in_flight.get(session_id, 0) - 1
+        if count > 0:
+            self._in_flight[session_id] = count
+        else:
+            self._in_flight.pop(session_id, None)
+        if session_id in self.connections:
+            self._last_used[session_id] = time.monotonic()
     
 
     async def close_connection(self, session_id: str) -> str:
         """关闭当前会话的SSH连接"""
         # client_id = ctx.session_id
-        if session_id in self.connections:
-            ssh = self.connections.pop(session_id)
-            ssh.close()
+        if session_id in self.connections or session_id in self._manifest:
+            # 与 ensure_connection 的恢复过程互斥，避免关闭后又被恢复的连接重新登记
+            async with self._session_locks.setdefault(session_id, asyncio.Lock()):
+                await self._drop_connection(session_id)
+                if session_id in self._manifest:
+                    await self._update_manifest(remove=[session_id])
+            self._session_locks.pop(session_id, None)
+            logger.info("Closed SSH session %s", session_id)
             return "SSH连接已关闭"
         return "无活动连接可关闭"
 
+    async def _drop_connection(self, session_id: str):
+        """关闭连接但保留会话清单记录"""
+        ssh = self.connections.get(session_id)
+        if ssh is None:
+            return
+        self._forget(session_id)
+        ssh.close()
+        await ssh.wait_closed()
+
+    async def _update_manifest(self, upsert: Optional[Dict[str, Dict[str, Any]]] = None,
+                               remove=(), touch=()):
+        """修改会话清单并写盘：新增/覆盖、删除、刷新使用时间，同时清除过期记录"""
+        async with self._manifest_lock:
+            now = time.time()
+            for session_id in remove:
+                self._manifest.pop(session_id, None)
+            for session_id, entry in (upsert or {}).items():
+                self._manifest[session_id] = dict(entry, last_used=now)
+            for session_id in touch:
+                if session_id in self._manifest:
+                    self._manifest[session_id]["last_used"] = now
+            self._manifest = self._unexpired(self._manifest, now)
+            # 持久化只是尽力而为：写盘失败不能影响已建立的连接或回收任务
+            try:
+                await asyncio.to_thread(self._write_manifest,
+                                        {sid: dict(entry) for sid, entry in self._manifest.items()})
+            except OSError as e:
+                logger.warning("Failed to write SSH session manifest %s: %s", self._manifest_path, e)
+
+    @staticmethod
+    def _unexpired(manifest: Dict[str, Dict[str, Any]], now: float) -> Dict[str, Dict[str, Any]]:
+        return {sid: entry for sid, entry in manifest.items()
+                if now - entry.get("last_used", 0) <= _MANIFEST_TTL}
+
+    def _read_manifest(self) -> Dict[str, Dict[str, Any]]:
+        """读取会话清单，文件不存在或损坏时返回空清单；过期记录直接丢弃"""
+        try:
+            with open(self._manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(manifest, dict):
+            return {}
+        # 丢弃结构不完整的记录，避免后续按字段查找时出错
+        manifest = {
+            sid: entry for sid, entry in manifest.items()
+            if isinstance(entry, dict)
+            and isinstance(entry.get("hostname"), str)
+            and isinstance(entry.get("port"), int)
+            and isinstance(entry.get("username"), str)
+            and "key_path" in entry
+            and (entry["key_path"] is None or isinstance(entry["key_path"], str))
+            and isinstance(entry.get("last_used", 0), (int, float))
+        }
+        return self._unexpired(manifest, time.time())
+
+    def _write_manifest(self, manifest: Dict[str, Dict[str, Any]]):
+        """原子地写入会话清单（先写临时文件再替换），文件权限仅限当前用户"""
+        self._manifest_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        tmp_path = self._manifest_path.with_suffix(".tmp")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(fd, 0o600)  # 临时文件已存在时 os.open 不会修改其权限
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    def _forget(self, session_id: str):
+        """从连接表和端点表中移除会话"""
+        self.connections.pop(session_id, None)
+        self._last_used.pop(session_id, None)
+        endpoint = self._endpoints.pop(session_id, None)
+        if endpoint is not None and self._by_endpoint.get(endpoint) == session_id:
+            del self._by_endpoint[endpoint]
+            # 同一端点若还有其他活动会话，改由其承接复用
+            for other_id, other_endpoint in self._endpoints.items():
+                if other_endpoint == endpoint:
+                    self._by_endpoint[endpoint] = other_id
+                    break
+
+    async def _forget_on_close(self, session_id: str, ssh):
+        """等待连接关闭后清理会话记录"""
+        await ssh.wait_closed()
+        if self.connections.get(session_id) is ssh:
+            self._forget(session_id)
+
+    async def _reap_idle_connections(self):
+        """定期关闭空闲超过 _IDLE_TIMEOUT 秒的连接"""
+        while self.connections:
+            await asyncio.sleep(_REAP_INTERVAL)
+            # 刷新仍保持连接的会话在清单中的使用时间，使其不会在服务重启后因过期而无法恢复
+            live = [sid for sid in self.connections if sid in self._manifest]
+            if live:
+                await self._update_manifest(touch=live)
+            now = time.monotonic()
+            for session_id, last_used in list(self._last_used.items()):
+                if self._in_flight.get(session_id, 0) > 0:
+                    continue
+                if now - last_used > _IDLE_TIMEOUT:
+                    # 仅断开套接字，会话清单中的记录保留，下次使用时按需重连
+                    logger.info("Closing idle SSH session %s", session_id)
+                    await self._drop_connection(session_id)
+
 # 初始化连接管理器
 ssh_manager = SSHConnectionManager()
 
@@ -117,6 +407,51 @@ async def ssh_exec(command: str, session_id: str):
         "message": result
     }
 
+@mcp.tool()
+async def ssh_exec_many(command: str, session_ids: List[str]) -> Dict[str, str]:
+    """
+    在多个SSH连接上并行执行同一命令
+    参数:
+      command: 要执行的Shell命令
+      session_ids: 会话ID列表
+    返回:
+      会话ID到执行结果的映射
+    """
+    semaphore = asyncio.Semaphore(_MAX_PARALLEL_EXEC)
+
+    async def run_one(session_id: str) -> str:
+        async with semaphore:
+            return await ssh_manager.exec_command(command, session_id)
+
+    results = await asyncio.gather(*(run_one(sid) for sid in session_ids),
+                                   return_exceptions=True)
+    return dict(zip(session_ids, map(str, results)))
+
+@mcp.tool()
+async def ssh_exec_stream(command: str, session_id: str, ctx: Context):
+    """
+    在SSH连接上执行长时间运行的命令，输出逐行作为日志通知实时推送
+    参数:
+      command: 要执行的Shell命令
+    返回:
+      输出的最后若干行
+    """
+    if not await ssh_manager.ensure_connection(session_id):
+        return {"message": "无活动SSH连接，请先建立连接"}
+
+    tail = deque(maxlen=_STREAM_TAIL_LINES)
+    try:
+        # aclosing 保证提前退出时生成器立即结束，释放其占用的执行计数
+        async with contextlib.aclosing(ssh_manager.stream_command(command, session_id)) as lines:
+            async for line in lines:
+                tail.append(line)
+                await ctx.info(line.rstrip("\n"))
+    except Exception as e:
+        return {"message": f"执行失败: {str(e)}"}
+    return {
+        "message": f"$ {command}\n" + "".join(tail) if tail else "命令已执行"
+    }
+
 @mcp.tool()
 async def ssh_disconnect(session_id):
     """关闭当前SSH连接"""
@@ -133,8 +468,8 @@ async def ssh_connect_by_alias(host_alias: str):
       host_alias: SSH配置中的主机别名（如 sugon）
     """
     try:
-        # 1. 加载SSH配置
-        config = SSHConnectionManager.load_ssh_config(host_alias)
+        # 1. 加载SSH配置（首次调用需读取并解析文件，放到线程中以免阻塞事件循环）
+        config = await asyncio.to_thread(SSHConnectionManager.load_ssh_config, host_alias)
         
         # 2. 提取关键参数（带默认值处理）
         hostname = config.get("hostname", "")
@@ -142,7 +477,7 @@ async def ssh_connect_by_alias(host_alias: str):
         username = config.get("user", "")
         identity_file = config.get("identityfile", [None])[0]  # 可能有多密钥
         
-        print(f"Connecting to {username}@{hostname}:{port} using key {identity_file}")
+        logger.debug("Connecting to %s@%s:%s using key %s", username, hostname, port, identity_file)
         # print(ctx.request_id, " ", ctx.client_id, " ", ctx.session.id)
 
         # 3. 建立连接
@@ -152,15 +487,23 @@ async def ssh_connect_by_alias(host_alias: str):
             username=username,
             key_path=identity_file  # 自动使用配置的密钥
         )
-        print(f"Connection result: {result}")
+        logger.info("Connection result: %s", result)
         return {
             "session_id": session_id, "message": result
         }
     
     except Exception as e:
-        print(f"Error connecting to {host_alias}: {str(e)}")
+        logger.error("Error connecting to %s: %s", host_alias, e)
         return TextContent(text=f"连接失败: {str(e)}")
 
+@mcp.tool()
+async def ssh_reload_config():
+    """重新读取 ~/.ssh/config（修改配置文件后调用）"""
+    _parsed_ssh_config.cache_clear()
+    return {
+        "message": "SSH配置已重新加载"
+    }
+
 # This is the main entry point for your server
 def main():
     logger.info('Starting your-new-server')
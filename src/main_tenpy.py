@@ -3,6 +3,9 @@ from mcp.types import TextContent
 import logging
 
 from pathlib import Path
+import copy
+import functools
+import json
 import yaml
 import inspect
 import math
@@ -20,59 +23,100 @@ logger = logging.getLogger(__name__)
 # Create the MCP server object
 mcp = FastMCP()
 
+try:
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _Dumper
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as _Loader, SafeDumper as _Dumper
+
+
+class _ConfigDumper(_Dumper):
+    """Dumper writing lists of scalars (e.g. the rows of product_state) in compact flow style."""
+
+
+def _represent_list(dumper, data):
+    flow_style = not any(isinstance(item, (list, dict)) for item in data)
+    return dumper.represent_sequence("tag:yaml.org,2002:seq", data, flow_style=flow_style)
+
+
+_ConfigDumper.add_representer(list, _represent_list)
+
+# Parsed yaml files keyed by path, validated against the file's mtime
+_yaml_cache: dict[Path, tuple[int, dict]] = {}
+
 # MCP tools
 def load_yaml(path):
     path = Path(path)
     if path.exists():
+        mtime = path.stat().st_mtime_ns
+        cached = _yaml_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return copy.deepcopy(cached[1])
         with path.open("r") as f:
-            data = yaml.safe_load(f) or {}
+            data = yaml.load(f, Loader=_Loader) or {}
+        _yaml_cache[path] = (mtime, copy.deepcopy(data))
     else:
         data = {}
-        with path.open("w") as f:
-            yaml.safe_dump(data, f)
+        dump_yaml(data, path)
     return data
 
 def dump_yaml(data, path):
     path = Path(path)
     path.parent.mkdir(parents=True, exist_ok=True)
     with path.open("w") as f:
-        yaml.safe_dump(data, f)
+        yaml.dump(data, f, Dumper=_ConfigDumper, default_flow_style=False)
+    _yaml_cache[path] = (path.stat().st_mtime_ns, copy.deepcopy(data))
 
 
 _ALLOWED_LATTICES_1D = {"Chain"}
 _ALLOWED_LATTICES_2D = {"Square", "Triangular", "Honeycomb",  "Kagome"}
 _ALLOWED_BC = {"open", "periodic"}
+_ALLOWED_MODEL_CLASSES = {"SpinModel"}
+# Number of sites in the unit cell of each supported lattice
+_UNIT_CELL_SIZES = {"Chain": 1, "Square": 1, "Triangular": 1, "Honeycomb": 2, "Kagome": 3}
+
+_DEFAULT_ALGORITHM_PARAMS = {
+    'algorithm': 'TwoSiteDMRGEngine',
+    'mixer': False,
+    'trunc_params': {
+        'svd_min': 1e-8
+    }
+}
+_DEFAULT_CONNECT_MEASUREMENTS = (
+    ["tenpy.simulations.measurement", "m_onsite_expectation_value",
+        {"opname": "Sz"}],
+    ["psi_method", "wrap correlation_function",
+        {"results_key": "<Sz_i Sz_j>", "ops1": "Sz", "ops2": "Sz"}],
+    ["psi_method", "wrap correlation_function",
+        {"results_key": "<Sp_i Sm_j>", "ops1": "Sp", "ops2": "Sm"}],
+)
 
 
-@mcp.tool()
-def spinhalf_lattice_config(lattice_type: str, Lx: int, Ly: int | None, 
-                            bc_x: str = "open", bc_y: str | None = "periodic", 
-                            path: str | Path | None = None) -> TextContent:
-    """
-    Build and write a tenpy lattice configuration for spin 1/2 models into a yaml file at the given path.
+def _get_model_class(model_class: str):
+    """Look up model_class in tenpy.models, refusing anything outside _ALLOWED_MODEL_CLASSES."""
+    if model_class not in _ALLOWED_MODEL_CLASSES:
+        raise ValueError(f"Unsupported model_class: {model_class}")
+    return getattr(tenpy.models, model_class)
 
-    Args:
-        lattice_type: 
-                The type of lattice. Must be one of the currently supported lattices:
-                1D: Chain.
-                2D: Square, Triangular, Honeycomb, Kagome.  
-        Lx: 
-            Lx of 2D lattice / L of 1D lattice.
-        Ly: 
-            Ly of 2D lattice / ignored for 1D lattice (better to set None).
-        bc_x:
-            Boundary condition along x direction of 2D lattice / Boundary condition of 1D lattice (better to set None). Default to be open.
-        bc_y:
-            Boundary condition along y direction of 2D lattice / ignored for 1D lattice. Default to be periodic.
-        path:
-            The path of the yaml file. If set to None, the default path is set to Path.cwd()/config.yml.
-    
-    Return:
-        The source code of the init_terms of the model_class. The LLM should read the source code and tell the user what physical parameters are further required (with their default values). It is better providing a explanation of each terms.
 
-    Note: 
-        For 2D lattices with cylinder boundary condition (i.e. bc_x = open and bc_y = periodic), larger lattice extent should correspond to the open boundary direction (i.e. Lx > Ly).
-    """
+@functools.lru_cache(maxsize=None)
+def _init_terms_source(cls) -> str:
+    """Source code of cls.init_terms, read from disk only once per class."""
+    return inspect.getsource(cls.init_terms)
+
+
+@functools.lru_cache(maxsize=4)
+def _build_model_cached(model_class: str, frozen_params: str):
+    return _get_model_class(model_class)(json.loads(frozen_params))
+
+
+def _build_model(model_class: str, model_params: dict):
+    """Build the tenpy model, reusing a recently built one for identical model_params."""
+    return _build_model_cached(model_class, json.dumps(model_params, sort_keys=True))
+
+
+def _set_lattice_params(data: dict, lattice_type: str, Lx: int, Ly: int | None,
+                        bc_x: str, bc_y: str | None) -> str:
+    """Write the lattice part of the spin 1/2 configuration into data and return the model class name."""
     model_class = "SpinModel"
     S = 0.5
 
@@ -90,8 +134,6 @@ def spinhalf_lattice_config(lattice_type: str, Lx: int, Ly: int | None,
     if d == 2 and bc_y not in _ALLOWED_BC:
         raise ValueError(f"Invalid bc_y: {bc_y}")
 
-    path = Path(path) if path is not None else (Path.cwd() / "config.yml")
-    data = load_yaml(path)
     data["model_class"] = model_class
     model_params = data.setdefault("model_params", {})
     
@@ -115,9 +157,121 @@ def spinhalf_lattice_config(lattice_type: str, Lx: int, Ly: int | None,
         model_params.pop("L", None)
     else:
         raise ValueError
+
+    return model_class
+
+
+def _set_model_params(data: dict, params_dict: dict[str, float]) -> dict:
+    """Merge params_dict into the model parameters of data and return them."""
+    model_params = data.setdefault("model_params", {})
+    for name, val in params_dict.items():
+        model_params[name] = val
+    
+    model_params["conserve"] = "best"
+    return model_params
+
+
+def _lattice_shape(model_params: dict) -> tuple:
+    """The tenpy lattice shape (Ls + (len(unit_cell),)) of model_params, without building the lattice."""
+    lattice_type = model_params["lattice"]
+    n_unit = _UNIT_CELL_SIZES[lattice_type]
+    if lattice_type in _ALLOWED_LATTICES_1D:
+        return (model_params["L"], n_unit)
+    return (model_params["Lx"], model_params["Ly"], n_unit)
+
+
+def _nest_list(flat: list, shape: tuple) -> list:
+    """Reshape a flat list into nested lists of the given shape (C order), like np.reshape(...).tolist()."""
+    if len(shape) <= 1:
+        return flat
+    step = len(flat) // shape[0]
+    return [_nest_list(flat[i * step:(i + 1) * step], shape[1:]) for i in range(shape[0])]
+
+
+def _set_initial_state_params(data: dict, tot_charge: float | None,
+                              is_conserve_str: str | None, shape: tuple) -> None:
+    """Write a random product state of the given lattice shape with total charge tot_charge into data."""
+    if tot_charge is not None and not math.isclose(2 * tot_charge, int(2 * tot_charge)):
+        raise ValueError("tot_charge is not half integer! ")
+
+    if is_conserve_str not in ["Sz", None]:
+        raise ValueError("Symmetry not yet supported! ")
+    
+    n_sites = math.prod(shape)
+
+    rng = np.random.default_rng()
+    if tot_charge is None:
+        n_up = int(rng.integers(n_sites))
+    else:
+        n_up = tot_charge + n_sites / 2
+        n_dn = -tot_charge + n_sites / 2
+        if not (math.isclose(n_up, int(n_up)) and math.isclose(n_dn, int(n_dn))):
+            raise ValueError("Inconsistent tot_charge and system size! ")
+        n_up = int(n_up)
+        n_dn = int(n_dn)
+        if not 0 <= n_up <= n_sites:
+            raise ValueError("Inconsistent tot_charge and system size! ")
+
+    # Only the n_up sampled sites are written; all other entries share the same "down" string
+    init = ["down"] * n_sites
+    for idx in rng.choice(n_sites, size=n_up, replace=False):
+        init[idx] = "up"
+    init = _nest_list(init, shape)
+
+    init_state_params = data.setdefault("initial_state_params", {})
+    init_state_params["method"] = "lat_product_state"
+    init_state_params["product_state"] = init
+
+
+def _set_dmrg_and_measu_params(data: dict, chi_max: int, max_sweeps: int) -> None:
+    """Write the DMRG algorithm and measurement parameters into data."""
+    data["simulation_class"] = "GroundStateSearch"
+    # Deep copies, so that edits to data never leak back into the module-level defaults
+    algorithm_params = copy.deepcopy(_DEFAULT_ALGORITHM_PARAMS)
+    algorithm_params['max_sweeps'] = max_sweeps
+    algorithm_params['trunc_params']['chi_max'] = chi_max
+    data["algorithm_params"] = algorithm_params
+
+    data["measure_initial"] = False
+    data["connect_measurements"] = copy.deepcopy(list(_DEFAULT_CONNECT_MEASUREMENTS))
+
+    data["output_filename_params"] = {"prefix": "result", "suffix": ".h5"}
+
+
+@mcp.tool()
+def spinhalf_lattice_config(lattice_type: str, Lx: int, Ly: int | None, 
+                            bc_x: str = "open", bc_y: str | None = "periodic", 
+                            path: str | Path | None = None) -> TextContent:
+    """
+    Build and write a tenpy lattice configuration for spin 1/2 models into a yaml file at the given path.
+
+    Args:
+        lattice_type: 
+                The type of lattice. Must be one of the currently supported lattices:
+                1D: Chain.
+                2D: Square, Triangular, Honeycomb, Kagome.  
+        Lx: 
+            Lx of 2D lattice / L of 1D lattice.
+        Ly: 
+            Ly of 2D lattice / ignored for 1D lattice (better to set None).
+        bc_x:
+            Boundary condition along x direction of 2D lattice / Boundary condition of 1D lattice (better to set None). Default to be open.
+        bc_y:
+            Boundary condition along y direction of 2D lattice / ignored for 1D lattice. Default to be periodic.
+        path:
+            The path of the yaml file. If set to None, the default path is set to Path.cwd()/config.yml.
     
+    Return:
+        The source code of the init_terms of the model_class. The LLM should read the source code and tell the user what physical parameters are further required (with their default values). It is better providing a explanation of each terms.
+
+    Note: 
+        For 2D lattices with cylinder boundary condition (i.e. bc_x = open and bc_y = periodic), larger lattice extent should correspond to the open boundary direction (i.e. Lx > Ly).
+    """
+    path = Path(path) if path is not None else (Path.cwd() / "config.yml")
+    data = load_yaml(path)
+    model_class = _set_lattice_params(data, lattice_type, Lx, Ly, bc_x, bc_y)
     dump_yaml(data, path)
-    return TextContent(type="text", text=inspect.getsource(eval(f"tenpy.models.{model_class}.init_terms")))
+    return TextContent(type="text", text=_init_terms_source(_get_model_class(model_class)))
 
 
 
@@ -143,16 +297,13 @@ def spinhalf_model_config(params_dict: dict[str, float],
 
     path = Path(path) if path is not None else (Path.cwd() / "config.yml")
     data = load_yaml(path)
+    model_params = _set_model_params(data, params_dict)
 
-    model_params = data.setdefault("model_params", {})
-    for name, val in params_dict.items():
-        model_params[name] = val
-    
-    model_params["conserve"] = "best"
-    dump_yaml(data, path)
-
-    model_obj =  eval(f"tenpy.models.{data["model_class"]}(model_params)")
+    model_obj = _build_model(data["model_class"], model_params)
     is_conserve_str = model_obj.lat.site(0).conserve
+    # Store the resolved conservation law, so later tools need not rebuild the model to find it
+    model_params["conserve"] = is_conserve_str
+    dump_yaml(data, path)
     return TextContent(type="text", text=f"The conservation property of the model is: {is_conserve_str}")
 
 
@@ -171,41 +322,17 @@ def spinhalf_initial_state(tot_charge: float | None, path: str | None = None) ->
     Return:
         A sentence of successful generation of initial state, and guide the LLM to further generate the DMRG algorithm parameters.
     """
-    if tot_charge is not None and not math.isclose(2 * tot_charge, int(2 * tot_charge)):
-        raise ValueError("tot_charge is not half integer! ")
-
     path = Path(path) if path is not None else (Path.cwd() / "config.yml")
     data = load_yaml(path)
-    model_params = data.get("model_params", {}).copy()
-
-    model_obj =  eval(f"tenpy.models.{data["model_class"]}(model_params)")
-    lat = model_obj.lat
-    is_conserve_str = lat.site(0).conserve
+    model_params = data.get("model_params", {})
 
-    if is_conserve_str not in ["Sz", None]:
-        raise ValueError("Symmetry not yet supported! ")
-    
-    shape = lat.shape
-    n_sites = lat.N_sites
-
-    if tot_charge is None:
-        n_up = np.random.randint(n_sites)
-        n_dn = n_sites - n_up
+    is_conserve_str = model_params.get("conserve", "best")
+    if is_conserve_str == "best":
+        lat = _build_model(data["model_class"], model_params).lat
+        is_conserve_str, shape = lat.site(0).conserve, lat.shape
     else:
-        n_up = tot_charge + n_sites / 2
-        n_dn = -tot_charge + n_sites / 2
-        if not (math.isclose(n_up, int(n_up)) and math.isclose(n_dn, int(n_dn))):
-            raise ValueError("Inconsistent tot_charge and system size! ")
-        n_up = int(n_up)
-        n_dn = int(n_dn)
-
-    init = np.array(["up"] * n_up + ["down"] * n_dn, dtype=str)
-    np.random.shuffle(init)
-    init = init.reshape(shape).tolist()
-
-    init_state_params = data.setdefault("initial_state_params", {})
-    init_state_params["method"] = "lat_product_state"
-    init_state_params["product_state"] = init
+        shape = _lattice_shape(model_params)
+    _set_initial_state_params(data, tot_charge, is_conserve_str, shape)
 
     dump_yaml(data, path) 
     return TextContent(type="text", text=f"The DMRG initial state is successfully generated! We should then set the DMRG algorithm parameters and measurement parameters. ")
@@ -228,32 +355,52 @@ def dmrg_and_measu_config(chi_max: int, max_sweeps: int, path: str | None = None
     """
     path = Path(path) if path is not None else (Path.cwd() / "config.yml")
     data = load_yaml(path)  
-    
-    data["simulation_class"] = "GroundStateSearch"
-    data["algorithm_params"] = {
-        'algorithm': 'TwoSiteDMRGEngine',
-        'max_sweeps': max_sweeps,
-        'mixer': False,
-        'trunc_params': {
-            'chi_max': chi_max,
-            'svd_min': 1e-8
-        }
-    }
+    _set_dmrg_and_measu_params(data, chi_max, max_sweeps)
+    dump_yaml(data, path)
+    return TextContent(type="text", text=f"All required configurations are generated. Ready for performing computations! ")
 
-    data["measure_initial"] = False
-    data["connect_measurements"] = [
-            ["tenpy.simulations.measurement", "m_onsite_expectation_value",
-                {"opname": "Sz"}],
-            ["psi_method", "wrap correlation_function",
-                {"results_key": "<Sz_i Sz_j>", "ops1": "Sz", "ops2": "Sz"}],
-            ["psi_method", "wrap correlation_function",
-                {"results_key": "<Sp_i Sm_j>", "ops1": "Sp", "ops2": "Sm"}],
-        ]
 
-    data["output_filename_params"] = {"prefix": "result", "suffix": ".h5"}
+@mcp.tool()
+def build_full_spinhalf_config(lattice_type: str, Lx: int, Ly: int | None,
+                               bc_x: str, bc_y: str | None,
+                               params_dict: dict[str, float], tot_charge: float | None,
+                               chi_max: int, max_sweeps: int,
+                               path: str | Path | None = None) -> TextContent:
+    """
+    Build and write the complete DMRG configuration for spin 1/2 models into a yaml file at the given path in a single call.
+    This is equivalent to calling spinhalf_lattice_config, spinhalf_model_config, spinhalf_initial_state and dmrg_and_measu_config in order, 
+    and should be preferred once all parameters are known. The arguments have the same meaning as in those tools.
+
+    Args:
+        lattice_type: 
+            The type of lattice, see spinhalf_lattice_config.
+        Lx, Ly, bc_x, bc_y:
+            The lattice extent and boundary conditions, see spinhalf_lattice_config.
+        params_dict:
+            A dictionary of model parameters, see spinhalf_model_config.
+        tot_charge:
+            The total symmetry charge of the initial state, see spinhalf_initial_state.
+        chi_max, max_sweeps:
+            The main DMRG algorithm parameters, see dmrg_and_measu_config.
+        path:
+            The path of the yaml file. If set to None, the default path is set to Path.cwd()/config.yml.
+
+    Return:
+        A prompt indicating the conservation property of the model and that all configurations are generated. Ready for computation.
+    """
+    path = Path(path) if path is not None else (Path.cwd() / "config.yml")
+    data = load_yaml(path)
+
+    model_class = _set_lattice_params(data, lattice_type, Lx, Ly, bc_x, bc_y)
+    model_params = _set_model_params(data, params_dict)
+    lat = _build_model(model_class, model_params).lat
+    is_conserve_str = lat.site(0).conserve
+    model_params["conserve"] = is_conserve_str
+    _set_initial_state_params(data, tot_charge, is_conserve_str, lat.shape)
+    _set_dmrg_and_measu_params(data, chi_max, max_sweeps)
 
     dump_yaml(data, path)
-    return TextContent(type="text", text=f"All required configurations are generated. Ready for performing computations! ")
+    return TextContent(type="text", text=f"The conservation property of the model is: {is_conserve_str}. All required configurations are generated. Ready for performing computations! ")
 
 
 @mcp.tool()
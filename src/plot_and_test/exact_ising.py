@@ -13,16 +13,21 @@ def quspin_ising_ground_energy(L: int, J: float, h: float) -> float:
     Returns:
         float: Ground state energy
     """
-    # 使用 pauli=True 来正确解释 "zz" 和 "x"
-    basis = spin_basis_1d(L=L) 
+    # 幺正变换 prod_i sigma^z_i 将 h 映射为 -h 而谱不变，因此可取 h >= 0。
+    # 此时非对角元非正，由 Perron-Frobenius 定理基态位于全对称扇区
+    # (自旋翻转 zblock=+1、反射 pblock=+1，PBC 下还有平移 kblock=0)。
+    h = abs(h)
 
     bc = "OBC"
     if bc == 'PBC':
         # 周期性边界条件 (Periodic Boundary Conditions)
         J_zz = [[J, i, (i + 1) % L] for i in range(L)]
+        # 使用 pauli=True 来正确解释 "zz" 和 "x"
+        basis = spin_basis_1d(L=L, pauli=True, kblock=0, pblock=1, zblock=1)
     elif bc == 'OBC':
         # 开放边界条件 (Open Boundary Conditions)
         J_zz = [[J, i, i + 1] for i in range(L - 1)]
+        basis = spin_basis_1d(L=L, pauli=True, pblock=1, zblock=1)
     else:
         raise ValueError("边界条件(bc)必须是 'PBC' 或 'OBC'")
         
@@ -32,6 +37,9 @@ def quspin_ising_ground_energy(L: int, J: float, h: float) -> float:
     
     H = hamiltonian(static, [], basis=basis, dtype=np.float64)
     
-    # 精确对角化求解基态能量
-    E = np.linalg.eigvalsh(H.toarray())[0]
+    # 精确对角化求解基态能量：小扇区直接稠密对角化，否则用稀疏 Lanczos 只求最低本征值
+    if basis.Ns <= 64:
+        E = H.eigvalsh()[0]
+    else:
+        E = H.eigsh(k=1, which="SA", return_eigenvectors=False)[0]
     return E
@@ -46,13 +46,20 @@ def tenpy_ising_energy(L: int, J: float, h: float) -> float:
 
 
 import numpy as np
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import h5py
 from tenpy.tools import hdf5_io
-from scipy.optimize import curve_fit
 import base64
 import io
 
+
+def cft_log_chord(l, L):
+    """Log of the chord length (L/pi) sin(pi l/L), the l-dependence of the CFT scaling form
+    S(l) = (c/6) log((L/pi) sin(pi l/L)) + const for a finite system of size L with periodic BC."""
+    return np.log((L / np.pi) * np.sin(np.pi * l / L))
+
+
 @mcp.tool()
 def plot_entanglement_entropy(filename: str) -> ImageContent:
     """Calculates and plots the entanglement entropy from DMRG data,
@@ -63,12 +70,6 @@ def plot_entanglement_entropy(filename: str) -> ImageContent:
     Returns:
         ImageContent: An object containing the base64 encoded PNG image of the plot.
     """
-    def cft_scaling(l, c, const):
-        """CFT scaling form for entanglement entropy in a finite system with periodic BC."""
-        L = 32  # System size is fixed in our data
-        # The argument of the log is the chord length
-        return (c / 6.) * np.log((L / np.pi) * np.sin(np.pi * l / L)) + const
-
     # Load the wavefunction at the critical point
     with h5py.File(filename, 'r') as f:
         psi_data = hdf5_io.load_from_hdf5(f)
@@ -78,30 +79,42 @@ def plot_entanglement_entropy(filename: str) -> ImageContent:
 
     # We calculate entropy for cuts from l=1 to l=L-1
     subsystem_sizes = np.arange(1, L)
-    entanglement_entropy = [psi.entanglement_entropy(i) for i in subsystem_sizes]
+    # A single call returns the entropies of all L-1 bonds of the finite MPS
+    entanglement_entropy = np.asarray(psi.entanglement_entropy())
 
-    # Perform the curve fit
+    # The scaling form is linear in (c, const) once the log term is computed, so the fit is a
+    # single linear least-squares solve
+    x = cft_log_chord(subsystem_sizes, L)
     # We exclude the edges (l=1 and l=L-1) from the fit
-    popt, pcov = curve_fit(cft_scaling, subsystem_sizes[1:-1], entanglement_entropy[0][1:-1])
-    fitted_c = popt[0]
-    fitted_const = popt[1]
+    A = np.column_stack([x[1:-1] / 6., np.ones(len(x) - 2)])
+    y = entanglement_entropy[1:-1]
+    (fitted_c, fitted_const), *_ = np.linalg.lstsq(A, y, rcond=None)
+    # Covariance estimate as in curve_fit: (A^T A)^-1 scaled by the residual variance
+    m, n = A.shape
+    residuals = y - A @ np.array([fitted_c, fitted_const])
+    pcov = np.linalg.inv(A.T @ A) * (residuals @ residuals / (m - n))
     c_error = np.sqrt(np.diag(pcov))[0]
 
-    # Plot the results
-    plt.figure(figsize=(10, 6))
-    plt.plot(subsystem_sizes, entanglement_entropy[0], 'o', label='DMRG Data')
-    plt.plot(subsystem_sizes, cft_scaling(subsystem_sizes, fitted_c, fitted_const), '-',
-             label=f'CFT Fit (c = {fitted_c:.4f} \pm {c_error:.4f})')
-    plt.xlabel('Subsystem size l')
-    plt.ylabel('Entanglement Entropy S(l)')
-    plt.title('Entanglement Entropy at the Critical Point (Jz=1.0, L=32)')
-    plt.legend()
-    plt.grid(True)
-
-    # Save plot to a bytes buffer and encode in base64
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    plt.close()
+    fitted_curve = (fitted_c / 6.) * x + fitted_const
+
+    # Plot the results on a figure-local canvas, so concurrent calls do not share pyplot state
+    fig = Figure(figsize=(10, 6))
+    try:
+        ax = fig.subplots()
+        ax.plot(subsystem_sizes, entanglement_entropy, 'o', label='DMRG Data')
+        ax.plot(subsystem_sizes, fitted_curve, '-',
+                label=rf'CFT Fit (c = {fitted_c:.4f} $\pm$ {c_error:.4f})')
+        ax.set_xlabel('Subsystem size l')
+        ax.set_ylabel('Entanglement Entropy S(l)')
+        ax.set_title(f'Entanglement Entropy at the Critical Point (Jz=1.0, L={L})')
+        ax.legend()
+        ax.grid(True)
+
+        # Save plot to a bytes buffer and encode in base64
+        buf = io.BytesIO()
+        FigureCanvasAgg(fig).print_png(buf)
+    finally:
+        fig.clf()
     image_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
     return ImageContent(data=image_base64, mimeType="image/png", type="image")
 